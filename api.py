@@ -1,13 +1,71 @@
 import os
-import duckdb
-from flask import Flask, jsonify, request, send_from_directory
+import asyncio
+import atexit
+import itertools
+import logging
+import logging.handlers
+import queue
+import threading
+import zlib
+import aiohttp
+import orjson
+import pyarrow.compute as pc
+from contextlib import contextmanager
+from functools import wraps
+from cachetools import TTLCache
+from flask import Flask, jsonify, request, send_from_directory, stream_with_context
+from flask.json.provider import DefaultJSONProvider, JSONProvider
 from flask_cors import CORS
+from db import connect_read_only, execute_prepared
 from rag import ClaudeService
+from setup_database import DB_PATH, migrate, require_migrated
 from datetime import datetime
 from flask_compress import Compress
 
+# Logging: records from every module (api, rag, db) are queued on the request thread
+# at the root logger and written by a background listener
+logging.root.setLevel(os.getenv('LOG_LEVEL', 'WARNING').upper())
+_log_queue = queue.SimpleQueue()
+logging.root.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger = logging.getLogger(__name__)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+try:
+    import uvloop
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())  # faster event loop for async views
+except ImportError:
+    pass
+
+class OrjsonProvider(JSONProvider):
+    """JSON provider backed by orjson so jsonify() encodes in native code"""
+    option = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+    sort_keys = False  # same meaning as DefaultJSONProvider.sort_keys
+    compact = True     # pretty-print only when explicitly set to False, even in debug
+
+    def _dumps_bytes(self, obj) -> bytes:
+        option = self.option
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.compact is False:
+            option |= orjson.OPT_INDENT_2
+        # Fall back to Flask's default hook for Decimal, UUID, etc.
+        return orjson.dumps(obj, default=DefaultJSONProvider.default, option=option)
+
+    def dumps(self, obj, **kwargs) -> str:
+        return self._dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self._dumps_bytes(obj), mimetype='application/json')
+
 # cors
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 
@@ -25,8 +83,11 @@ app.config['COMPRESS_MIMETYPES'] = [
     'image/svg+xml'
 ]
 
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip', 'deflate']  # prefer brotli when the client accepts it
+app.config['COMPRESS_ALGORITHM_STREAMING'] = ['br', 'deflate']  # streamed /api/poi (gzip streams: see _gzip_chunks)
+app.config['COMPRESS_BR_LEVEL'] = 4  # Brotli quality 0-11 (4 fast, still smaller than gzip 6)
 app.config['COMPRESS_LEVEL'] = 6  # Compression level 1-9 (6 balance)
-app.config['COMPRESS_MIN_SIZE'] = 500  # responses > 500 bytes
+app.config['COMPRESS_MIN_SIZE'] = 1024  # responses > 1 KB, smaller ones are not worth the CPU
 app.config['COMPRESS_CACHE_KEY'] = None  # Disable caching karena kita bukan static response
 app.config['COMPRESS_CACHE_TIMEOUT'] = 5 * 60  # Cache 5 menit
 app.config['COMPRESS_STREAMS'] = True  # Enable streaming compression
@@ -41,31 +102,210 @@ compress.init_app(app) # otomatis
 # Initialize Claude service
 CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY')
 if not CLAUDE_API_KEY:
-    print("⚠️ CLAUDE_API_KEY not set. Claude features will be disabled.")
+    logger.warning("CLAUDE_API_KEY not set. Claude features will be disabled.")
     claude_service = None
 else:
-    claude_service = ClaudeService(CLAUDE_API_KEY)
+    claude_service = ClaudeService(CLAUDE_API_KEY, DB_PATH)
+
+    # ClaudeService coroutines all run on one long-lived event loop: the async client's
+    # connection pool is bound to the loop it first runs on, so per-request loops won't do
+    _claude_loop = asyncio.new_event_loop()
+    threading.Thread(target=_claude_loop.run_forever, name='claude-loop', daemon=True).start()
+
+# A call may use every client retry, each up to the request timeout, plus retry backoff
+CLAUDE_RESULT_TIMEOUT = ClaudeService.REQUEST_TIMEOUT * (ClaudeService.MAX_RETRIES + 1) + 30
+
+def run_claude(coro):
+    """Run a ClaudeService coroutine on the shared loop and wait for its result"""
+    future = asyncio.run_coroutine_threadsafe(coro, _claude_loop)
+    try:
+        return future.result(timeout=CLAUDE_RESULT_TIMEOUT)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+def iter_claude(chunks):
+    """Iterate a ClaudeService async iterator from a (sync) response generator"""
+    try:
+        while True:
+            try:
+                yield run_claude(chunks.__anext__())
+            except StopAsyncIteration:
+                return
+    finally:
+        run_claude(chunks.aclose())
+
+# Every entry point other than `python api.py` (which migrates in __main__ below) is
+# expected to serve a migrated file: refuse to start instead of failing each request
+if __name__ != '__main__':
+    require_migrated(DB_PATH)
 
-# Database connection
-DB_PATH = 'localpulse.db'
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 4))
 
+_db = None
+_db_pool = queue.Queue()
+_db_pool_lock = threading.Lock()
+
+def _prepared_variants(name: str, query: str, optional_filters: list, first_param: int,
+                       order_by: str = None) -> dict:
+    """Expand a query into one statement per combination of optional equality filters"""
+    variants = {}
+    for enabled in itertools.product((False, True), repeat=len(optional_filters)):
+        sql, suffix, param = query, '', first_param
+        for column, on in zip(optional_filters, enabled):
+            if on:
+                sql += f" AND {column} = ${param}"
+                suffix += f"_{column}"
+                param += 1
+        variants[name + suffix] = f"{sql} ORDER BY {order_by}" if order_by else sql
+    return variants
+
+POI_STREAM_BATCH_ROWS = 2048
+
+# Hot queries, prepared once on every pooled cursor (name -> SQL with $n parameters)
+PREPARED_STATEMENTS = {
+    # /api/financial: Bank/ATM rows, optionally narrowed by district and category
+    **_prepared_variants('financial', """
+        SELECT id, name, category AS type, latitude AS lat, longitude AS lng, province, district, 
+               rating, rating_count, gmaps_link, bank_category, bank_colorcode
+        FROM poi_financial 
+        WHERE province = $1""", ['district', 'category'], first_param=2, order_by='category, name'),
+    # /api/poi: detail rows within the intensity range
+    **_prepared_variants('poi_detail', """
+        SELECT id, name, latitude AS lat, longitude AS lng, intensity, category, province, district,
+               rating, rating_count, gmaps_link
+        FROM poi_density_only 
+        WHERE province = $1 AND intensity >= $2 AND intensity <= $3""", ['district', 'category'],
+        first_param=4, order_by='intensity DESC, category, id'),
+    # /api/poi: the same rows as a ready-made [[lat, lng, intensity], ...] JSON array,
+    # in the same order as poi_detail so heatmap_data[i] matches detailed_data[i]
+    **_prepared_variants('poi_heatmap', """
+        SELECT COUNT(*) AS count,
+               to_json(list([latitude, longitude, intensity] ORDER BY intensity DESC, category, id)) AS heatmap
+        FROM poi_density_only 
+        WHERE province = $1 AND intensity >= $2 AND intensity <= $3""", ['district', 'category'],
+        first_param=4),
+    # /api/poi: district/category breakdown and per-district summary in one scan,
+    # GROUPING(category) = 0 -> (district, category) rows, 1 -> district rollup
+    'poi_grouped': """
+        SELECT district, category, COUNT(*) as count, ROUND(AVG(intensity), 3) as avg_intensity,
+               COUNT(DISTINCT category) as categories,
+               GROUPING(category) = 1 as is_summary
+        FROM poi_density_only 
+        WHERE province = $1
+        GROUP BY GROUPING SETS ((district, category), (district))
+        ORDER BY is_summary, AVG(intensity) DESC""",
+}
+
+def _init_db_pool():
+    """Open the shared read-only database and fill the cursor pool (once per process)"""
+    global _db
+    with _db_pool_lock:
+        if _db is None:
+            db = connect_read_only(DB_PATH)
+            for _ in range(DB_POOL_SIZE):
+                cursor = db.cursor()
+                for name, sql in PREPARED_STATEMENTS.items():
+                    cursor.execute(f"PREPARE {name} AS {sql}")
+                _db_pool.put(cursor)
+            _db = db
+
+@contextmanager
 def get_db_connection():
-    """Get database connection"""
-    return duckdb.connect(DB_PATH)
+    """Borrow a pooled database connection for the duration of a request"""
+    if _db is None:
+        _init_db_pool()
+    conn = _db_pool.get()
+    try:
+        yield conn
+    finally:
+        _db_pool.put(conn)
+
+# Response cache for read-only GET endpoints: encoded (compressed) bodies keyed by
+# path + query string + negotiated encoding. Entries only expire through the TTL; the
+# database file cannot be rebuilt while server processes hold it open, so a rebuild
+# always comes with a restart and empty caches.
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+_response_cache = TTLCache(maxsize=256, ttl=RESPONSE_CACHE_TTL)
+_response_cache_lock = threading.Lock()
+
+def cached_response(view):
+    """Serve repeated GETs with identical query strings from the response cache"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        # Keyed on the chosen encoding, not the header text, so equivalent
+        # Accept-Encoding spellings share one entry
+        accepted = request.accept_encodings.best_match(app.config['COMPRESS_ALGORITHM'])
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), accepted)
+        with _response_cache_lock:
+            entry = _response_cache.get(key)
+        if entry is not None:
+            body, encoding = entry
+            response = app.response_class(body, mimetype='application/json')
+            if encoding:
+                # Already compressed; Flask-Compress skips responses with a Content-Encoding
+                response.headers['Content-Encoding'] = encoding
+            return response
+        
+        # Compress here rather than in the after_request hook, so the cache holds
+        # the bytes that are sent and hits are not compressed again
+        response = compress.after_request(app.make_response(view(*args, **kwargs)))
+        if response.is_streamed and 'Content-Encoding' not in response.headers and accepted == 'gzip':
+            # Flask-Compress does not gzip streams, and gzip-only clients are common
+            response.response = _gzip_chunks(response.iter_encoded())
+            response.headers['Content-Encoding'] = 'gzip'
+            response.headers.pop('Content-Length', None)
+        # Only successful responses are cached; errors are retried on the next request.
+        # A body in an encoding other than the key's (q-value edge cases Flask-Compress
+        # reads differently) is sent but not cached, so no client gets one it refused.
+        encoding = response.headers.get('Content-Encoding')
+        if response.status_code == 200 and encoding in (None, accepted):
+            if response.is_streamed:
+                response.response = _tee_into_cache(key, response.response, response, encoding)
+            else:
+                with _response_cache_lock:
+                    _response_cache[key] = (response.get_data(), encoding)
+        return response
+    return wrapper
+
+def _gzip_chunks(chunks):
+    """Gzip a streamed body chunk by chunk, at the configured COMPRESS_LEVEL"""
+    compressor = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def _tee_into_cache(key, chunks, response, encoding):
+    """Pass a streamed body through, caching it once it has been sent completely"""
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    # Views set stream_failed when they had to end the body with an error
+    if getattr(response, 'stream_failed', False):
+        return
+    with _response_cache_lock:
+        _response_cache[key] = (b''.join(body), encoding)
 
 @app.route('/<path:filename>')
 def static_files(filename):
     return send_from_directory('.', filename)
 
 @app.route('/api/health', methods=['GET'])
+@cached_response
 def health_check():
     """Enhanced health check with Claude service status"""
     try:
-        conn = get_db_connection()
-        poi_total = conn.execute("SELECT COUNT(*) FROM poi_density").fetchone()[0]
-        poi_financial = conn.execute("SELECT COUNT(*) FROM poi_density WHERE category IN ('Bank', 'ATM')").fetchone()[0]
-        poi_density = conn.execute("SELECT COUNT(*) FROM poi_density WHERE category NOT IN ('Bank', 'ATM')").fetchone()[0]
-        conn.close()
+        with get_db_connection() as conn:
+            # Plain row counts of the pre-split partitions, no per-row predicate
+            poi_total, poi_financial, poi_density = conn.execute("""
+                SELECT (SELECT COUNT(*) FROM poi_density),
+                       (SELECT COUNT(*) FROM poi_financial),
+                       (SELECT COUNT(*) FROM poi_density_only)
+            """).fetchone()
         
         return jsonify({
             'success': True,
@@ -84,6 +324,8 @@ def health_check():
                 '/api/poi', 
                 '/api/health',
                 '/api/chat',
+                '/api/chat/stream',
+                '/api/chat/batch',
                 '/api/search'
             ]
         })
@@ -113,33 +355,137 @@ def chat_endpoint():
             }), 503
         
         # Generate response with Claude
-        print(f"Processing query: {query}")
-        response_text, map_directive = claude_service.generate_response(query)
-        print(f"Response generated: {len(response_text)} characters")
+        logger.info("Processing query: %s", query)
+        response_text, map_directive = run_claude(claude_service.generate_response(query))
+        logger.info("Response generated: %d characters", len(response_text))
         
         return jsonify({
             'success': True,
             'query': query,
             'response': response_text,
-            'map_directive': {
-                'mode': map_directive.mode,
-                'filters': map_directive.filters,
-                'center': map_directive.center,
-                'zoom': map_directive.zoom,
-                'highlights': map_directive.highlights or []
-            },
+            'map_directive': map_directive_to_dict(map_directive),
             'timestamp': datetime.now().isoformat()
         })
         
     except Exception as e:
-        print(f"Chat endpoint error: {e}")
+        logger.exception("Chat endpoint error")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream_endpoint():
+    """Chat with the response streamed as NDJSON: map directive first, then text chunks as Claude writes them"""
+    try:
+        data = request.get_json()
+        
+        if not data or 'query' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'Query is required'
+            }), 400
+        
+        query = data['query'].strip()
+        
+        if not claude_service:
+            return jsonify({
+                'success': False,
+                'error': 'Claude service not available. Please set CLAUDE_API_KEY environment variable.'
+            }), 503
+        
+        logger.info("Processing streamed query: %s", query)
+        chunks, map_directive = run_claude(claude_service.stream_response(query))
+        
+        def generate():
+            yield orjson.dumps({
+                'type': 'map_directive',
+                'query': query,
+                'map_directive': map_directive_to_dict(map_directive)
+            }) + b'\n'
+            try:
+                for text in iter_claude(chunks):
+                    yield orjson.dumps({'type': 'text', 'text': text}) + b'\n'
+            except Exception as e:
+                # Claude failed mid-answer: no 'done', so the client knows the text is incomplete
+                yield orjson.dumps({'type': 'error', 'error': str(e)}) + b'\n'
+                return
+            yield orjson.dumps({'type': 'done', 'timestamp': datetime.now().isoformat()}) + b'\n'
+        
+        # NDJSON is not in COMPRESS_MIMETYPES, so chunks are flushed as they arrive
+        return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+        
+    except Exception as e:
+        logger.exception("Chat stream endpoint error")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch_endpoint():
+    """Submit non-interactive queries to the Claude Message Batches API"""
+    try:
+        data = request.get_json()
+        queries = data.get('queries') if data else None
+        if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q.strip() for q in queries):
+            return jsonify({
+                'success': False,
+                'error': 'A non-empty list of queries is required'
+            }), 400
+        
+        if not claude_service:
+            return jsonify({
+                'success': False,
+                'error': 'Claude service not available. Please set CLAUDE_API_KEY environment variable.'
+            }), 503
+        
+        batch = run_claude(claude_service.submit_batch([q.strip() for q in queries]))
+        for item in batch['requests']:
+            item['map_directive'] = map_directive_to_dict(item['map_directive'])
+        
+        return jsonify({
+            'success': True,
+            **batch,
+            'timestamp': datetime.now().isoformat()
+        }), 202
+        
+    except Exception as e:
+        logger.exception("Chat batch endpoint error")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@app.route('/api/chat/batch/<batch_id>', methods=['GET'])
+def chat_batch_status(batch_id):
+    """Poll a submitted batch; results are included once it has ended"""
+    if not claude_service:
+        return jsonify({'success': False, 'error': 'Claude service not available'}), 503
+    
+    try:
+        return jsonify({
+            'success': True,
+            **run_claude(claude_service.get_batch(batch_id))
+        })
+    except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+def map_directive_to_dict(map_directive) -> dict:
+    """Response shape of a MapDirective"""
+    return {
+        'mode': map_directive.mode,
+        'filters': map_directive.filters,
+        'center': map_directive.center,
+        'zoom': map_directive.zoom,
+        'highlights': map_directive.highlights or []
+    }
+
 @app.route('/api/search', methods=['POST'])
-def search_endpoint():
+async def search_endpoint():
     """Web search integration for real-time data"""
     try:
         data = request.get_json()
@@ -147,7 +493,7 @@ def search_endpoint():
         location = data.get('location', 'Bali')
         
         # Implement web search logic
-        search_results = perform_web_search(query, location)
+        search_results = await perform_web_search(query, location)
         
         return jsonify({
             'success': True,
@@ -163,21 +509,43 @@ def search_endpoint():
             'error': str(e)
         }), 500
 
-def perform_web_search(query: str, location: str) -> list:
-    """Perform web search for real-time data"""
-    # Placeholder implementation
-    # In production, integrate with:
-    # - Google Search API
-    # - Bing Search API  
-    # - SerpAPI
-    # - Custom web scraping
-    
+# Web search providers: async callables (session, keywords) -> list of results.
+# In production, add adapters for:
+# - Google Search API
+# - Bing Search API  
+# - SerpAPI
+# - Custom web scraping
+SEARCH_PROVIDERS = []
+SEARCH_CONCURRENCY = 10  # max provider requests in flight per search
+SEARCH_TIMEOUT = aiohttp.ClientTimeout(total=10)
+
+async def _search_provider(provider, session: aiohttp.ClientSession, semaphore: asyncio.Semaphore,
+                           keywords: str) -> list:
+    """Query one provider; a failing provider contributes no results instead of failing the search"""
+    async with semaphore:
+        try:
+            return await provider(session, keywords)
+        except Exception as e:
+            logger.warning("Search provider %s error: %s", getattr(provider, '__name__', provider), e)
+            return []
+
+async def perform_web_search(query: str, location: str) -> list:
+    """Perform web search for real-time data, fanning out to all providers concurrently"""
     search_keywords = f"{query} {location} bank ATM ekonomi"
     
-    # Return empty results for now - web search integration to be implemented
-    search_results = []
+    # Return empty results until a provider is configured
+    if not SEARCH_PROVIDERS:
+        return []
+    
+    semaphore = asyncio.Semaphore(SEARCH_CONCURRENCY)
+    async with aiohttp.ClientSession(timeout=SEARCH_TIMEOUT) as session:
+        async with asyncio.TaskGroup() as group:
+            tasks = [
+                group.create_task(_search_provider(provider, session, semaphore, search_keywords))
+                for provider in SEARCH_PROVIDERS
+            ]
     
-    return search_results
+    return [result for task in tasks for result in task.result()]
 
 @app.route('/api/conversation', methods=['GET'])
 def get_conversation_history():
@@ -216,72 +584,50 @@ def clear_conversation_history():
         }), 500
 
 @app.route('/api/financial', methods=['GET'])
+@cached_response
 def get_financial_data():
-    """Get financial institutions data from poi_density table"""
+    """Get financial institutions data from the poi_financial partition"""
     try:
-        conn = get_db_connection()
-        
         # Get query parameters
         type_filter = request.args.get('type')
         province_filter = request.args.get('province', 'Bali')
         district_filter = request.args.get('district')
         
-        # Build query for Bank and ATM categories only
-        query = """
-            SELECT id, name, category, latitude, longitude, province, district, 
-                   rating, rating_count, gmaps_link, bank_category, bank_colorcode
-            FROM poi_density 
-            WHERE category IN ('Bank', 'ATM') AND province = ?
-        """
+        # Pick the prepared variant for the filters present
+        statement = 'financial'
         params = [province_filter]
         
         if district_filter:
-            query += " AND district = ?"
+            statement += '_district'
             params.append(district_filter)
             
         if type_filter and type_filter.upper() in ['BANK', 'ATM']:
-            query += " AND category = ?"
+            statement += '_category'
             params.append(type_filter.title())
         
-        query += " ORDER BY category, name"
-        
-        # Execute query
-        result = conn.execute(query, params).fetchall()
-        conn.close()
+        # Execute query; rows come back as dicts built from the Arrow result
+        with get_db_connection() as conn:
+            result = execute_prepared(conn, statement, params).fetch_arrow_table().to_pylist()
         
         # Format response
         data = {
             'success': True,
             'count': len(result),
             'data': {
-                'banks': [],
-                'atms': []
+                'banks': [row for row in result if row['type'] == 'Bank'],
+                'atms': [row for row in result if row['type'] != 'Bank']
             }
         }
         
-        for row in result:
-            institution = {
-                'id': row[0],
-                'name': row[1],
-                'type': row[2],  # category
-                'lat': row[3],
-                'lng': row[4],
-                'province': row[5],
-                'district': row[6],
-                'rating': row[7],
-                'rating_count': row[8],
-                'gmaps_link': row[9],
-                'bank_category': row[10],
-                'bank_colorcode': row[11]
-            }
-            
-            if row[2] == 'Bank':
-                data['data']['banks'].append(institution)
-            else:
-                data['data']['atms'].append(institution)
-        
         return jsonify(data)
         
+    except ValueError as e:
+        # Malformed query arguments (non-numeric intensity, characters SQL cannot carry)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+        
     except Exception as e:
         return jsonify({
             'success': False,
@@ -289,11 +635,10 @@ def get_financial_data():
         }), 500
 
 @app.route('/api/poi', methods=['GET'])
+@cached_response
 def get_poi_data():
     """Get POI density data (excluding Bank and ATM categories)"""
     try:
-        conn = get_db_connection()
-        
         # Get query parameters
         province_filter = request.args.get('province', 'Bali')
         district_filter = request.args.get('district')
@@ -301,102 +646,71 @@ def get_poi_data():
         min_intensity = float(request.args.get('min_intensity', 0))
         max_intensity = float(request.args.get('max_intensity', 1))
         
-        # Build query - exclude Bank and ATM for density analysis
-        query = """
-            SELECT id, name, latitude, longitude, intensity, category, province, district,
-                   rating, rating_count, gmaps_link
-            FROM poi_density 
-            WHERE category NOT IN ('Bank', 'ATM') 
-            AND province = ? AND intensity >= ? AND intensity <= ?
-        """
+        # Pick the prepared variants for the filters present
+        suffix = ''
         params = [province_filter, min_intensity, max_intensity]
         
         if district_filter:
-            query += " AND district = ?"
+            suffix += '_district'
             params.append(district_filter)
             
         if category_filter:
-            query += " AND category = ?"
+            suffix += '_category'
             params.append(category_filter)
         
-        query += " ORDER BY intensity DESC, category"
-        
-        # Execute query
-        result = conn.execute(query, params).fetchall()
-        
-        # Format response for heatmap (simplified format)
-        heatmap_data = []
-        detailed_data = []
+        with get_db_connection() as conn:
+            # For heatmap: DuckDB emits the JSON array text, spliced in without re-encoding
+            count, heatmap_json = execute_prepared(conn, 'poi_heatmap' + suffix, params).fetchone()
+            heatmap_data = orjson.Fragment(heatmap_json or '[]')
         
-        for row in result:
-            # For heatmap: [lat, lng, intensity]
-            heatmap_data.append([row[2], row[3], row[4]])
+            grouped = execute_prepared(conn, 'poi_grouped', [province_filter]).fetch_arrow_table()
             
-            # For detailed view
-            detailed_data.append({
-                'id': row[0],
-                'name': row[1],
-                'lat': row[2],
-                'lng': row[3],
-                'intensity': row[4],
-                'category': row[5],
-                'province': row[6],
-                'district': row[7],
-                'rating': row[8],
-                'rating_count': row[9],
-                'gmaps_link': row[10]
-            })
-        
-        # Get district/category summary
-        district_result = conn.execute("""
-            SELECT district, category, COUNT(*) as count, AVG(intensity) as avg_intensity
-            FROM poi_density 
-            WHERE category NOT IN ('Bank', 'ATM') AND province = ?
-            GROUP BY district, category
-            ORDER BY avg_intensity DESC
-        """, [province_filter]).fetchall()
-        
-        districts = []
-        for row in district_result:
-            districts.append({
-                'district': row[0],
-                'category': row[1],
-                'count': row[2],
-                'avg_intensity': round(row[3], 3)
-            })
-        
-        # Get overall district summary
-        district_summary = conn.execute("""
-            SELECT district, COUNT(*) as count, AVG(intensity) as avg_intensity,
-                   COUNT(DISTINCT category) as categories
-            FROM poi_density 
-            WHERE category NOT IN ('Bank', 'ATM') AND province = ?
-            GROUP BY district
-            ORDER BY avg_intensity DESC
-        """, [province_filter]).fetchall()
-        
-        summary = []
-        for row in district_summary:
-            summary.append({
-                'district': row[0],
-                'count': row[1],
-                'avg_intensity': round(row[2], 3),
-                'categories': row[3]
-            })
-        
-        conn.close()
-        
-        # Response format
-        response_data = {
+            # For detailed view: fetched into Arrow now, so the cursor goes back to the
+            # pool before a slow client starts reading the stream
+            detailed = execute_prepared(conn, 'poi_detail' + suffix, params).fetch_arrow_table()
+        
+        # Split the two grouping levels in Arrow; rounding already happened in SQL
+        is_summary = grouped.column('is_summary')
+        districts = grouped.filter(pc.invert(is_summary)).select(
+            ['district', 'category', 'count', 'avg_intensity']).to_pylist()
+        summary = grouped.filter(is_summary).select(
+            ['district', 'count', 'avg_intensity', 'categories']).to_pylist()
+        
+        # Response format; detailed_data goes last so it can be streamed batch by batch
+        head = app.json.dumps({
             'success': True,
-            'count': len(result),
+            'count': count,
             'heatmap_data': heatmap_data,
-            'detailed_data': detailed_data,
             'districts': districts,
             'district_summary': summary
-        }
+        })
         
-        return jsonify(response_data)
+        def generate():
+            yield head[:-1].encode() + b',"detailed_data":['
+            # Encoded batch by batch, so the full row list never exists as Python objects
+            try:
+                separator = b''
+                for batch in detailed.to_batches(max_chunksize=POI_STREAM_BATCH_ROWS):
+                    if batch.num_rows:
+                        yield separator + orjson.dumps(batch.to_pylist())[1:-1]
+                        separator = b','
+            except Exception as e:
+                # The 200 status is already sent: close the JSON with an error instead
+                logger.exception("POI stream error")
+                response.stream_failed = True
+                yield b'],"error":' + orjson.dumps(str(e)) + b'}'
+                return
+            yield b']}'
+        
+        response = app.response_class(generate(), mimetype='application/json')
+        return response
+        
+    except ValueError as e:
+        # Malformed query arguments (non-numeric intensity, characters SQL cannot carry)
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
         
     except Exception as e:
         return jsonify({
@@ -410,15 +724,21 @@ if __name__ == '__main__':
         print("❌ Database not found. Please run setup_database.py first.")
         exit(1)
     
+    # Indexes etc. must exist before the read-only pool attaches
+    migrate(DB_PATH)
+    
     print("🚀 Enhanced LocalPulse API Server with Claude LLM starting...")
     print(f"📡 Listening on http://0.0.0.0:8081")
     print(f"🤖 Claude LLM: {'Enabled' if claude_service else 'Disabled (set CLAUDE_API_KEY)'}")
     print(f"🔗 Available endpoints:")
     print(f"   - http://0.0.0.0:8081/api/health")
     print(f"   - http://0.0.0.0:8081/api/chat (POST)")
+    print(f"   - http://0.0.0.0:8081/api/chat/batch (POST, GET /<batch_id>)")
     print(f"   - http://0.0.0.0:8081/api/financial")
     print(f"   - http://0.0.0.0:8081/api/poi")
     print(f"   - http://0.0.0.0:8081/api/search (POST)")
     print("=" * 50)
+    print("⚠️ Development server (single process). For production run:")
+    print("   gunicorn -c gunicorn.conf.py api:app")
     
-    app.run(host='0.0.0.0', port=8081, debug=False)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=8081, debug=False, threaded=True)
\ No newline at end of file
@@ -1,51 +1,101 @@
+import os
+import re
 import duckdb
 import threading
 from contextlib import contextmanager
+from functools import lru_cache
 from typing import Optional, List, Tuple
 import logging
+from setup_database import DB_PATH
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Handlers are configured by the entry point (api.py, or main() below)
 logger = logging.getLogger(__name__)
 
+# DuckDB settings for every connection this process opens. With several gunicorn
+# workers, per-process threads/memory must stay bounded to avoid oversubscription.
+# DuckDB refuses a second connection to the same file with a different config.
+DB_CONFIG = {
+    'threads': int(os.getenv('DB_THREADS', 2)),
+    'memory_limit': os.getenv('DB_MEMORY_LIMIT', '1GB'),
+    'preserve_insertion_order': False,  # every API query that needs an order has ORDER BY
+}
+
+def connect_read_only(db_path: str) -> duckdb.DuckDBPyConnection:
+    """Open a read-only DuckDB connection with the shared DB_CONFIG"""
+    return duckdb.connect(db_path, read_only=True, config=DB_CONFIG)
+
+_SURROGATE_RE = re.compile('[\ud800-\udfff]')
+
+def sql_literal(value) -> str:
+    """Render a bind value as a SQL literal (EXECUTE does not accept ? placeholders)"""
+    if isinstance(value, str):
+        # The DuckDB parser rejects NUL and cannot encode lone surrogates; refuse
+        # them here so a user value can never break the statement text
+        if '\x00' in value or _SURROGATE_RE.search(value):
+            raise ValueError("Parameter contains an unsupported character")
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, float):
+        return f"'{value!r}'::DOUBLE"  # also covers inf/nan
+    raise TypeError(f"Unsupported parameter type: {type(value).__name__}")
+
+def execute_prepared(conn, name: str, params: list):
+    """Run a statement created with PREPARE on this connection"""
+    args = ', '.join(sql_literal(value) for value in params)
+    return conn.execute(f"EXECUTE {name}({args})")
+
 class DatabaseManager:
-    """Thread-safe DuckDB connection manager"""
-    def __init__(self, db_path: str = 'localpulse.db'):
+    """Thread-safe DuckDB connection manager (one cursor per thread)"""
+    def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
-        self._lock = threading.Lock()
+        self._lock = threading.Lock()  # guards opening/closing the shared connection only
         self._connection = None
-        self._connection_count = 0
+        self._local = threading.local()
     
     def _get_connection(self) -> duckdb.DuckDBPyConnection:
-        """Get or create a database connection"""
+        """Get or create the shared database connection"""
         if self._connection is None:
-            try:
-                self._connection = duckdb.connect(self.db_path)
-                logger.info(f"Created new database connection to {self.db_path}")
-            except Exception as e:
-                logger.error(f"Failed to connect to database: {e}")
-                raise
+            with self._lock:
+                if self._connection is None:
+                    try:
+                        self._connection = connect_read_only(self.db_path)
+                        logger.info(f"Created new read-only database connection to {self.db_path}")
+                    except Exception as e:
+                        logger.error(f"Failed to connect to database: {e}")
+                        raise
         return self._connection
     
+    def _get_cursor(self) -> duckdb.DuckDBPyConnection:
+        """Get this thread's cursor on the shared connection"""
+        connection = self._get_connection()
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None or getattr(self._local, 'parent', None) is not connection:
+            cursor = connection.cursor()
+            self._local.cursor = cursor
+            self._local.parent = connection
+        return cursor
+    
     @contextmanager
     def get_connection(self):
         """Context manager for safe database connections"""
-        with self._lock:
-            self._connection_count += 1
-            conn = self._get_connection()
+        # DuckDB runs one query at a time per cursor, so threads never share one
+        conn = self._get_cursor()
+        try:
+            yield conn
+        except Exception as e:
+            logger.error(f"Database operation error: {e}")
+            # Drop this thread's cursor on error to prevent reusing a broken handle
+            self._discard_cursor()
+            raise
+    
+    def _discard_cursor(self):
+        """Close and forget the calling thread's cursor"""
+        cursor = getattr(self._local, 'cursor', None)
+        self._local.cursor = None
+        if cursor is not None:
             try:
-                yield conn
+                cursor.close()
             except Exception as e:
-                logger.error(f"Database operation error: {e}")
-                # Close connection on error to prevent corruption
-                self.close_connection()
-                raise
-            finally:
-                self._connection_count -= 1
-                if self._connection_count == 0:
-                    # Optional: close connection when not in use
-                    # self.close_connection()
-                    pass
+                logger.error(f"Error closing cursor: {e}")
     
     def close_connection(self):
         """Safely close the database connection"""
@@ -58,7 +108,6 @@ class DatabaseManager:
                     logger.error(f"Error closing connection: {e}")
                 finally:
                     self._connection = None
-                    self._connection_count = 0
     
     def execute_query(self, query: str, params: Optional[List] = None) -> List[Tuple]:
         """Execute a query safely"""
@@ -138,25 +187,45 @@ def get_poi_data(category: Optional[str] = None, district: Optional[str] = None,
     
     return db.execute_query(query, params if params else None)
 
-def get_categories() -> List[str]:
-    """Get all unique categories"""
+# DISTINCT lookups only change when the database is reloaded, so they are
+# scanned once per process; call clear_cache() after a reload.
+@lru_cache(maxsize=1)
+def _categories() -> Tuple[str, ...]:
     result = db.execute_query('SELECT DISTINCT category FROM poi_density ORDER BY category')
-    return [row[0] for row in result]
+    return tuple(row[0] for row in result)
 
-def get_districts() -> List[str]:
-    """Get all unique districts"""
+@lru_cache(maxsize=1)
+def _districts() -> Tuple[str, ...]:
     result = db.execute_query('SELECT DISTINCT district FROM poi_density ORDER BY district')
-    return [row[0] for row in result]
+    return tuple(row[0] for row in result)
 
-def get_bank_categories() -> List[str]:
-    """Get all unique bank categories"""
+@lru_cache(maxsize=1)
+def _bank_categories() -> Tuple[str, ...]:
     result = db.execute_query('''
         SELECT DISTINCT bank_category 
         FROM poi_density 
         WHERE bank_category IS NOT NULL 
         ORDER BY bank_category
     ''')
-    return [row[0] for row in result]
+    return tuple(row[0] for row in result)
+
+def get_categories() -> List[str]:
+    """Get all unique categories"""
+    return list(_categories())
+
+def get_districts() -> List[str]:
+    """Get all unique districts"""
+    return list(_districts())
+
+def get_bank_categories() -> List[str]:
+    """Get all unique bank categories"""
+    return list(_bank_categories())
+
+def clear_cache():
+    """Forget memoized lookups (after the database has been reloaded)"""
+    _categories.cache_clear()
+    _districts.cache_clear()
+    _bank_categories.cache_clear()
 
 def get_poi_summary() -> dict:
     """Get summary statistics about POI data"""
@@ -192,6 +261,7 @@ def get_poi_summary() -> dict:
 
 def main():
     """Test the database manager"""
+    logging.basicConfig(level=logging.INFO)
     print("Testing Database Manager")
     print("=" * 30)
     
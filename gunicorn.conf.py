@@ -0,0 +1,17 @@
+# Gunicorn settings for the LocalPulse API
+# Usage: gunicorn -c gunicorn.conf.py api:app
+import os
+from setup_database import DB_PATH, migrate
+
+bind = os.getenv('BIND', '0.0.0.0:8081')
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+# Silent-worker timeout: the master restarts a worker that stops sending heartbeats for
+# this long. gthread workers keep sending them while requests run, so this is not a
+# per-request limit; Claude waits are bounded by api.CLAUDE_RESULT_TIMEOUT instead.
+timeout = 120
+
+def on_starting(server):
+    """Run migrations in the master, before any worker opens the database read-only"""
+    migrate(DB_PATH)
\ No newline at end of file
@@ -1,28 +1,224 @@
 import os
-import json
-import duckdb
+import re
+import asyncio
+import logging
+import threading
 import anthropic
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-from dataclasses import dataclass
+from collections import deque
+import orjson
+from cachetools import TTLCache
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Mapping, Optional, Tuple
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+from db import connect_read_only, execute_prepared
+from setup_database import DB_PATH
 
-@dataclass
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+@dataclass(slots=True, frozen=True)
 class MapDirective:
     """Instructions for map visualization based on LLM analysis"""
     mode: str  # "gdp", "whitespots", "risk", "heatmap", "financial", "business_analysis"
     filters: Dict[str, any]
     center: Optional[Tuple[float, float]] = None
     zoom: Optional[int] = None
-    highlights: List[Dict] = None
+    highlights: Tuple[Dict, ...] = field(default_factory=tuple)
+
+# Default map centers
+MAP_CENTERS = {
+    'Bali': (-8.6705, 115.2126),
+    'Indonesia': (-2.5, 118)
+}
+
+# Basic stats for a location with no POI data
+_ZERO_STATS = MappingProxyType({'total_banks': 0, 'total_atms': 0, 'total_poi': 0})
+
+# Map view (center, zoom) per location; other locations get the Bali center zoomed out
+_LOC_VIEW = {
+    'Bali': (MAP_CENTERS['Bali'], 10),
+    'Indonesia': (MAP_CENTERS['Indonesia'], 5)
+}
+_DEFAULT_VIEW = (MAP_CENTERS['Bali'], 5)
+
+# Pre-defined recommended areas for Bali business analysis (shared, read-only)
+_RECOMMENDED_BALI_AREAS = (
+    MappingProxyType({
+        'name': 'Seminyak Business District',
+        'coordinates': (-8.6872, 115.1748),
+        'district': 'Badung',
+        'business_potential': 'HIGH'
+    }),
+    MappingProxyType({
+        'name': 'Ubud Cultural Center', 
+        'coordinates': (-8.5088, 115.2623),
+        'district': 'Gianyar',
+        'business_potential': 'HIGH'
+    }),
+    MappingProxyType({
+        'name': 'Canggu Beach Area',
+        'coordinates': (-8.6482, 115.1374), 
+        'district': 'Badung',
+        'business_potential': 'HIGH'
+    })
+)
+
+def _json_default(obj):
+    """orjson fallback: read-only mappings as objects, anything else as a string"""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    return str(obj)
+
+def _dump_context(context: Dict) -> str:
+    """Pretty-printed JSON of a database context for the system prompt"""
+    option = orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC
+    return orjson.dumps(context, default=_json_default, option=option).decode()
+
+# Map directive per intent; center and zoom follow _LOC_VIEW unless set here
+_DIRECTIVE_CONFIG = {
+    "gdp_national": {
+        "mode": "gdp",
+        "filters": {},
+        "center": MAP_CENTERS['Indonesia'],
+        "zoom": 5
+    },
+    "whitespots": {
+        "mode": "whitespots", 
+        "filters": {"show_heatmap": True, "show_financial": True}
+    },
+    "risk_assessment": {
+        "mode": "risk",
+        "filters": {"show_heatmap": True, "show_financial": True, "highlight_risk": True}
+    },
+    "bank_distribution": {
+        "mode": "financial",
+        "filters": {"show_financial": True, "group_by_category": True}
+    },
+    "business_analysis": {
+        "mode": "business_analysis",
+        "filters": {
+            "show_heatmap": True, 
+            "show_poi_density": True,
+            "show_financial": True,
+            "show_recommended_areas": True
+        },
+        "zoom": 11
+    }
+}
+
+@lru_cache(maxsize=64)
+def _make_directive(intent: str, location: str) -> MapDirective:
+    """Map directive for (intent, location); cached, so callers must not mutate it"""
+    config = _DIRECTIVE_CONFIG.get(intent, _DIRECTIVE_CONFIG["gdp_national"])
+    center, zoom = _LOC_VIEW.get(location, _DEFAULT_VIEW)
+    return MapDirective(
+        mode=config["mode"],
+        filters=config["filters"],
+        center=config.get("center", center),
+        zoom=config.get("zoom", zoom)
+    )
 
 class ClaudeService:
-    def __init__(self, api_key: str, db_path: str = 'localpulse.db'):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+    MAX_HISTORY = 200
+    # Per-request timeout in seconds; callers waiting on a result bound their wait by it
+    REQUEST_TIMEOUT = 120.0
+    MAX_RETRIES = 2
+    
+    # Counts behind get_basic_stats for all provinces at once, summed from district_agg
+    PROVINCE_STATS = """
+        SELECT province, SUM(banks), SUM(atms), SUM(poi_points)
+        FROM district_agg
+        GROUP BY province"""
+    
+    # Analytical queries, prepared once on each thread's cursor (name -> SQL with $n parameters)
+    PREPARED_STATEMENTS = {
+        # Both read district_agg, precomputed by setup_database.migrate
+        'district_analysis': """
+            SELECT district,
+                   banks,
+                   atms, 
+                   total_financial,
+                   COALESCE(avg_poi_density, 0) as avg_poi_density,
+                   CASE 
+                       WHEN avg_poi_density > 0.7 AND total_financial < 2 THEN 'HIGH_PRIORITY_WHITESPACE'
+                       WHEN avg_poi_density > 0.5 AND total_financial < 3 THEN 'MEDIUM_PRIORITY_WHITESPACE'
+                       WHEN avg_poi_density < 0.3 AND total_financial > 2 THEN 'POTENTIAL_RISK_OVERSUPPLY'
+                       WHEN avg_poi_density < 0.2 AND total_financial > 0 THEN 'HIGH_RISK_LOW_DEMAND'
+                       ELSE 'BALANCED'
+                   END as area_classification
+            FROM district_agg
+            WHERE province = $1 AND total_financial > 0
+            ORDER BY avg_poi_density DESC NULLS LAST""",
+        'business_opportunities': """
+            SELECT district,
+                   avg_poi_density as avg_activity_density,
+                   poi_points as total_activity_points,
+                   high_spots as high_activity_spots,
+                   ROUND(avg_poi_density * poi_points, 2) as business_opportunity_score
+            FROM district_agg 
+            WHERE province = $1 AND poi_points > 0 AND avg_poi_density > 0.5
+            ORDER BY business_opportunity_score DESC
+            LIMIT 10""",
+    }
+    
+    # Simple prompts for basic intents
+    SIMPLE_PROMPTS = {
+        'greeting': "You are LocalPulse.AI assistant. Say hello, mention you help with banking/economic analysis, ask how to help. Be friendly and concise (max 2 sentences).",
+        'general_info': "You are LocalPulse.AI. Briefly explain you help analyze banking and economic data in Indonesia. Be concise (max 3 sentences).",
+        'gdp_national': "You are LocalPulse.AI. Give a general economic overview for Indonesia without detailed analysis (max 4 sentences)."
+    }
+    
+    # Comprehensive prompt for analytical intents (str.format template)
+    ANALYTICAL_PROMPT = """
+        You are LocalPulse.AI, an advanced economic and banking analysis system for Indonesia.
+
+        **Analysis Context:**
+        - Intent: {intent}
+        - Location: {location}
+        - Date: {date}
+
+        **Database Context:**
+        {db_json}
+
+        **Guidelines:**
+        1. Use real data from the context
+        2. Be specific with numbers and district names
+        3. Provide actionable insights
+        4. Match user's language (Indonesian/English)
+        5. Structure clearly with headings and bullet points
+
+        **Focus Areas:**
+        - whitespots: High-opportunity areas with specific recommendations
+        - risk_assessment: Branch vulnerability with risk classifications  
+        - bank_distribution: Coverage analysis by district
+        - business_analysis: Market opportunities with competitive analysis
+        """
+    
+    def __init__(self, api_key: str, db_path: str = DB_PATH):
+        # Async client: in-flight Claude calls share an event loop instead of each holding a thread
+        self.client = anthropic.AsyncAnthropic(
+            api_key=api_key, timeout=self.REQUEST_TIMEOUT, max_retries=self.MAX_RETRIES
+        )
         self.db_path = db_path
-        self.conversation_history = []
+        # Most recent exchanges only, so memory stays bounded in a long-running server
+        self.conversation_history = deque(maxlen=self.MAX_HISTORY)
+        
+        # Shared read-only connection (opened on first query), one cursor per thread
+        self._conn = None
+        self._conn_lock = threading.Lock()
+        self._local = threading.local()
         
-        # Cache for database connections and common queries
-        self._db_cache = {}
+        # Workers for running independent context queries concurrently
+        self._query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rag-db')
+        
+        # Cache for common queries: bounded LRU with a 5-minute TTL so stats refresh
+        self._db_cache = TTLCache(maxsize=128, ttl=300)
+        self._db_cache_lock = threading.Lock()
         
         # Simplified intent keywords for better performance
         self.INTENT_KEYWORDS = {
@@ -37,41 +233,79 @@ class ClaudeService:
         # Bank entity patterns
         self.BANK_ENTITIES = ['bni', 'bca', 'bri', 'mandiri', 'bsi', 'btn', 'cimb', 'danamon']
         
-        # Default map centers
-        self.MAP_CENTERS = {
-            'Bali': (-8.6705, 115.2126),
-            'Indonesia': (-2.5, 118)
-        }
+        # One alternation regex over every intent keyword, one named group per intent,
+        # so a query is scanned once. The lookahead reports a match at every
+        # position, so overlapping keywords of different intents are all seen.
+        self._intent_priority = {intent_type: priority for priority, intent_type in enumerate(self.INTENT_KEYWORDS)}
+        self._intent_re = re.compile('(?=(?:' + '|'.join(
+            f"(?P<{intent_type}>{'|'.join(map(re.escape, keywords))})"
+            for intent_type, keywords in self.INTENT_KEYWORDS.items()
+        ) + '))')
+        
+        # Bank names are matched as whole tokens
+        self._bank_set = frozenset(self.BANK_ENTITIES)
+        
+        # Prompt date, formatted once per day
+        self._today_date = None
+        self._today_str = ''
+    
+    def _get_shared_connection(self):
+        """Open the long-lived read-only connection once, with simple retry logic"""
+        if self._conn is None:
+            with self._conn_lock:
+                if self._conn is None:
+                    # Same read-only config as the API pool, or DuckDB rejects the connection
+                    try:
+                        self._conn = connect_read_only(self.db_path)
+                    except Exception as e:
+                        # Single retry
+                        try:
+                            self._conn = connect_read_only(self.db_path)
+                        except Exception:
+                            raise e
+        return self._conn
     
     def get_db_connection(self):
-        """Get database connection with simple retry logic"""
-        try:
-            return duckdb.connect(self.db_path)
-        except Exception as e:
-            # Single retry
-            try:
-                return duckdb.connect(self.db_path)
-            except Exception:
-                raise e
+        """Get this thread's cursor on the shared database connection"""
+        conn = self._get_shared_connection()
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None or self._local.parent is not conn:
+            cursor = conn.cursor()
+            for name, sql in self.PREPARED_STATEMENTS.items():
+                cursor.execute(f"PREPARE {name} AS {sql}")
+            self._local.cursor = cursor
+            self._local.parent = conn
+        return cursor
+    
+    def close(self):
+        """Close the query pool and the shared database connection (and with it every cursor)"""
+        self._query_pool.shutdown(wait=True)
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
     
     def extract_intent_and_entities(self, query: str) -> Tuple[str, List[str], str]:
         """Fast intent extraction using keyword matching (removed Claude API call for performance)"""
         query_lower = query.lower()
         
-        # Intent classification using optimized keyword matching
+        # Intent classification in a single pass over the query
         intent = 'general_info'  # default
-        for intent_type, keywords in self.INTENT_KEYWORDS.items():
-            if any(word in query_lower for word in keywords):
-                intent = intent_type
-                break
+        intent_priority = len(self.INTENT_KEYWORDS)
+        for match in self._intent_re.finditer(query_lower):
+            priority = self._intent_priority[match.lastgroup]
+            if priority < intent_priority:
+                # Earlier INTENT_KEYWORDS groups win, as with the ordered keyword loop
+                intent, intent_priority = match.lastgroup, priority
         
         # Entity extraction
         entities = []
         if 'bali' in query_lower:
             entities.append('Bali')
         
-        # Extract bank entities
-        bank_entities = [bank.upper() for bank in self.BANK_ENTITIES if bank in query_lower]
+        # Extract bank entities: one tokenization plus a set intersection
+        banks_found = self._bank_set.intersection(_TOKEN_RE.findall(query_lower))
+        bank_entities = [bank.upper() for bank in self.BANK_ENTITIES if bank in banks_found]
         entities.extend(bank_entities)
         
         # Location determination
@@ -79,107 +313,54 @@ class ClaudeService:
         
         return intent, entities, location
     
-    def get_basic_stats(self, location: str) -> Dict:
-        """Get basic database statistics (cached for performance)"""
-        cache_key = f"basic_stats_{location}"
+    def _stats_by_province(self) -> Dict[str, Mapping]:
+        """Basic stats for every province, read in one query and cached with the other results (raises on DB errors)"""
+        with self._db_cache_lock:
+            cached = self._db_cache.get('stats_by_province')
+        if cached is not None:
+            return cached
         
-        if cache_key in self._db_cache:
-            return self._db_cache[cache_key]
+        conn = self.get_db_connection()
         
+        stats = {
+            province: MappingProxyType({
+                'total_banks': total_banks,
+                'total_atms': total_atms,
+                'total_poi': total_poi
+            })
+            for province, total_banks, total_atms, total_poi in conn.execute(self.PROVINCE_STATS).fetchall()
+        }
+        with self._db_cache_lock:
+            self._db_cache['stats_by_province'] = stats
+        return stats
+    
+    def _fetch_rows(self, statement: str, location: str) -> List[Dict]:
+        """Run one of the prepared context queries for a location (raises on DB errors)"""
+        conn = self.get_db_connection()
+        return execute_prepared(conn, statement, [location]).fetch_arrow_table().to_pylist()
+    
+    def get_basic_stats(self, location: str) -> Mapping:
+        """Get basic database statistics (read-only, cached for performance)"""
         try:
-            conn = self.get_db_connection()
-            
-            stats = {
-                'total_banks': conn.execute(
-                    "SELECT COUNT(*) FROM poi_density WHERE category = 'Bank' AND province = ?", 
-                    [location]
-                ).fetchone()[0],
-                'total_atms': conn.execute(
-                    "SELECT COUNT(*) FROM poi_density WHERE category = 'ATM' AND province = ?", 
-                    [location]
-                ).fetchone()[0],
-                'total_poi': conn.execute(
-                    "SELECT COUNT(*) FROM poi_density WHERE category NOT IN ('Bank', 'ATM') AND province = ?", 
-                    [location]
-                ).fetchone()[0]
-            }
-            
-            conn.close()
-            self._db_cache[cache_key] = stats
-            return stats
-            
-        except Exception as e:
-            print(f"Database stats error: {e}")
-            return {'total_banks': 0, 'total_atms': 0, 'total_poi': 0}
+            return self._stats_by_province().get(location, _ZERO_STATS)
+        except Exception:
+            logger.exception("Database stats error")
+            return _ZERO_STATS
     
-    def get_district_analysis(self, location: str) -> List:
-        """Get district analysis for whitespots and risk assessment"""
+    def get_district_analysis(self, location: str) -> List[Dict]:
+        """Get district analysis for whitespots and risk assessment (one dict per district)"""
         try:
-            conn = self.get_db_connection()
-            
-            result = conn.execute("""
-                SELECT d.district,
-                       d.banks,
-                       d.atms, 
-                       d.total_financial,
-                       COALESCE(p.avg_poi_density, 0) as avg_poi_density,
-                       CASE 
-                           WHEN p.avg_poi_density > 0.7 AND d.total_financial < 2 THEN 'HIGH_PRIORITY_WHITESPACE'
-                           WHEN p.avg_poi_density > 0.5 AND d.total_financial < 3 THEN 'MEDIUM_PRIORITY_WHITESPACE'
-                           WHEN p.avg_poi_density < 0.3 AND d.total_financial > 2 THEN 'POTENTIAL_RISK_OVERSUPPLY'
-                           WHEN p.avg_poi_density < 0.2 AND d.total_financial > 0 THEN 'HIGH_RISK_LOW_DEMAND'
-                           ELSE 'BALANCED'
-                       END as area_classification
-                FROM (
-                    SELECT district,
-                           COUNT(CASE WHEN category = 'Bank' THEN 1 END) as banks,
-                           COUNT(CASE WHEN category = 'ATM' THEN 1 END) as atms,
-                           COUNT(*) as total_financial
-                    FROM poi_density 
-                    WHERE category IN ('Bank', 'ATM') AND province = ?
-                    GROUP BY district
-                ) d
-                LEFT JOIN (
-                    SELECT district,
-                           AVG(intensity) as avg_poi_density
-                    FROM poi_density 
-                    WHERE category NOT IN ('Bank', 'ATM') AND province = ?
-                    GROUP BY district
-                ) p ON d.district = p.district
-                ORDER BY p.avg_poi_density DESC NULLS LAST
-            """, [location, location]).fetchall()
-            
-            conn.close()
-            return result
-            
-        except Exception as e:
-            print(f"District analysis error: {e}")
+            return self._fetch_rows('district_analysis', location)
+        except Exception:
+            logger.exception("District analysis error")
             return []
     
-    def get_business_opportunities(self, location: str) -> List:
-        """Get business opportunity analysis with recommended areas"""
+    def get_business_opportunities(self, location: str) -> List[Dict]:
+        """Get business opportunity analysis with recommended areas (one dict per district)"""
         try:
-            conn = self.get_db_connection()
-            
-            opportunities = conn.execute("""
-                SELECT district,
-                       AVG(intensity) as avg_activity_density,
-                       COUNT(*) as total_activity_points,
-                       COUNT(CASE WHEN intensity > 0.7 THEN 1 END) as high_activity_spots,
-                       ROUND(AVG(intensity) * COUNT(*), 2) as business_opportunity_score
-                FROM poi_density 
-                WHERE category NOT IN ('Bank', 'ATM') AND province = ?
-                GROUP BY district
-                HAVING AVG(intensity) > 0.5
-                ORDER BY business_opportunity_score DESC
-                LIMIT 10
-            """, [location]).fetchall()
-            
-            conn.close()
-            return opportunities
-            
-        except Exception as e:
-            print(f"Business opportunities error: {e}")
+            return self._fetch_rows('business_opportunities', location)
+        except Exception:
+            logger.exception("Business opportunities error")
             return []
     
     def get_database_context(self, intent: str, location: str = "Bali") -> Dict:
@@ -187,127 +368,80 @@ class ClaudeService:
         if not location or location == "None":
             location = "Bali"
         
-        context = self.get_basic_stats(location)
+        cache_key = f"context_{intent}_{location}"
+        with self._db_cache_lock:
+            cached = self._db_cache.get(cache_key)
+        if cached is not None:
+            return cached
         
-        # Add intent-specific data only when needed
+        # Run the intent-specific query on a pool thread (its own cursor) while
+        # basic stats are fetched here
+        extra = None
         if intent in ['whitespots', 'risk_assessment']:
-            context['district_analysis'] = self.get_district_analysis(location)
-        
+            extra = ('district_analysis', self._query_pool.submit(self._fetch_rows, 'district_analysis', location))
         elif intent == 'business_analysis':
-            context['business_opportunities'] = self.get_business_opportunities(location)
+            extra = ('business_opportunities', self._query_pool.submit(self._fetch_rows, 'business_opportunities', location))
+        
+        # Every failed query falls back to empty data, and the context is then not cached
+        complete = True
+        try:
+            stats = self._stats_by_province().get(location, _ZERO_STATS)
+        except Exception:
+            logger.exception("Database stats error")
+            stats, complete = _ZERO_STATS, False
+        
+        # Copy so intent-specific keys never leak into the cached basic stats
+        context = dict(stats)
+        
+        # Add intent-specific data only when needed
+        if extra is not None:
+            key, future = extra
+            try:
+                context[key] = future.result()
+            except Exception:
+                logger.exception("Database context error (%s)", key)
+                context[key], complete = [], False
+        
+        if intent == 'business_analysis':
             # Add pre-defined recommended areas for Bali
             if location == "Bali":
-                context['recommended_business_areas'] = [
-                    {
-                        'name': 'Seminyak Business District',
-                        'coordinates': [-8.6872, 115.1748],
-                        'district': 'Badung',
-                        'business_potential': 'HIGH'
-                    },
-                    {
-                        'name': 'Ubud Cultural Center', 
-                        'coordinates': [-8.5088, 115.2623],
-                        'district': 'Gianyar',
-                        'business_potential': 'HIGH'
-                    },
-                    {
-                        'name': 'Canggu Beach Area',
-                        'coordinates': [-8.6482, 115.1374], 
-                        'district': 'Badung',
-                        'business_potential': 'HIGH'
-                    }
-                ]
+                context['recommended_business_areas'] = _RECOMMENDED_BALI_AREAS
         
+        # Serialize once per context; create_system_prompt reuses it
+        context['__json__'] = _dump_context(context)
+        if complete:
+            with self._db_cache_lock:
+                self._db_cache[cache_key] = context
         return context
     
     def generate_map_directive(self, intent: str, location: str) -> MapDirective:
         """Generate map visualization directives"""
-        center = self.MAP_CENTERS.get(location, self.MAP_CENTERS['Bali'])
-        zoom = 10 if location == "Bali" else 5
-        
-        directive_config = {
-            "gdp_national": {
-                "mode": "gdp",
-                "filters": {},
-                "center": self.MAP_CENTERS['Indonesia'],
-                "zoom": 5
-            },
-            "whitespots": {
-                "mode": "whitespots", 
-                "filters": {"show_heatmap": True, "show_financial": True},
-                "center": center,
-                "zoom": zoom
-            },
-            "risk_assessment": {
-                "mode": "risk",
-                "filters": {"show_heatmap": True, "show_financial": True, "highlight_risk": True},
-                "center": center,
-                "zoom": zoom
-            },
-            "bank_distribution": {
-                "mode": "financial",
-                "filters": {"show_financial": True, "group_by_category": True},
-                "center": center,
-                "zoom": zoom
-            },
-            "business_analysis": {
-                "mode": "business_analysis",
-                "filters": {
-                    "show_heatmap": True, 
-                    "show_poi_density": True,
-                    "show_financial": True,
-                    "show_recommended_areas": True
-                },
-                "center": center,
-                "zoom": 11
-            }
-        }
-        
-        # Get config or use default
-        config = directive_config.get(intent, directive_config["gdp_national"])
-        return MapDirective(**config)
+        return _make_directive(intent, location)
+    
+    def _today(self) -> str:
+        """Today's date as YYYY-MM-DD, re-formatted only when the day changes"""
+        today = date.today()
+        if today != self._today_date:
+            self._today_str = today.strftime('%Y-%m-%d')
+            self._today_date = today
+        return self._today_str
     
     def create_system_prompt(self, intent: str, location: str, db_context: Dict) -> str:
         """Create appropriate system prompt based on complexity"""
         
-        # Simple prompts for basic intents
-        simple_intents = {
-            'greeting': "You are LocalPulse.AI assistant. Say hello, mention you help with banking/economic analysis, ask how to help. Be friendly and concise (max 2 sentences).",
-            'general_info': "You are LocalPulse.AI. Briefly explain you help analyze banking and economic data in Indonesia. Be concise (max 3 sentences).",
-            'gdp_national': "You are LocalPulse.AI. Give a general economic overview for Indonesia without detailed analysis (max 4 sentences)."
-        }
-        
-        if intent in simple_intents:
-            return simple_intents[intent]
+        if intent in self.SIMPLE_PROMPTS:
+            return self.SIMPLE_PROMPTS[intent]
         
         # Comprehensive prompt for analytical intents
-        return f"""
-        You are LocalPulse.AI, an advanced economic and banking analysis system for Indonesia.
-
-        **Analysis Context:**
-        - Intent: {intent}
-        - Location: {location}
-        - Date: {datetime.now().strftime('%Y-%m-%d')}
-
-        **Database Context:**
-        {json.dumps(db_context, indent=2, default=str)}
-
-        **Guidelines:**
-        1. Use real data from the context
-        2. Be specific with numbers and district names
-        3. Provide actionable insights
-        4. Match user's language (Indonesian/English)
-        5. Structure clearly with headings and bullet points
-
-        **Focus Areas:**
-        - whitespots: High-opportunity areas with specific recommendations
-        - risk_assessment: Branch vulnerability with risk classifications  
-        - bank_distribution: Coverage analysis by district
-        - business_analysis: Market opportunities with competitive analysis
-        """
+        return self.ANALYTICAL_PROMPT.format(
+            intent=intent,
+            location=location,
+            date=self._today(),
+            db_json=db_context.get('__json__') or _dump_context(db_context)
+        )
     
-    def generate_response(self, query: str) -> Tuple[str, MapDirective]:
-        """Generate intelligent response with map directives"""
+    def build_message_request(self, query: str) -> Tuple[Dict, MapDirective, str, Dict]:
+        """Build Messages API parameters for a query, plus its map directive, location and DB context"""
         
         # Extract intent and entities
         intent, entities, location = self.extract_intent_and_entities(query)
@@ -329,29 +463,66 @@ class ClaudeService:
         # Create system prompt
         system_prompt = self.create_system_prompt(intent, location, db_context)
         
+        params = {
+            "model": self.CLAUDE_MODEL,
+            "max_tokens": max_tokens,
+            "system": system_prompt,
+            "messages": [{"role": "user", "content": f'User Query: "{query}"\n\nProvide helpful response based on context.'}]
+        }
+        return params, map_directive, location, db_context
+    
+    async def generate_response(self, query: str) -> Tuple[str, MapDirective]:
+        """Generate intelligent response with map directives"""
+        # DuckDB calls are blocking, so keep them off the event loop
+        params, map_directive, location, db_context = await asyncio.to_thread(self.build_message_request, query)
+        
         # Generate Claude response
         try:
-            response = self.client.messages.create(
-                model="claude-3-5-sonnet-20241022",
-                max_tokens=max_tokens,
-                system=system_prompt,
-                messages=[{"role": "user", "content": f'User Query: "{query}"\n\nProvide helpful response based on context.'}]
-            )
-            
-            # Store in conversation history
-            self.conversation_history.append({
-                "timestamp": datetime.now().isoformat(),
-                "query": query,
-                "response": response.content[0].text
-            })
+            response = await self.client.messages.create(**params)
             
+            self._record_exchange(query, response.content[0].text)
             return response.content[0].text, map_directive
             
         except Exception as e:
-            print(f"Claude API error: {e}")
-            
-            # Fallback response with available data
-            error_response = f"""
+            logger.exception("Claude API error")
+            return self._fallback_response(location, db_context, e), map_directive
+    
+    async def stream_response(self, query: str) -> Tuple[AsyncIterator[str], MapDirective]:
+        """Like generate_response, but the text arrives as an async iterator of chunks
+
+        The iterator raises if Claude fails after some text has been yielded.
+        """
+        params, map_directive, location, db_context = await asyncio.to_thread(self.build_message_request, query)
+        
+        async def chunks():
+            parts = []
+            try:
+                async with self.client.messages.stream(**params) as stream:
+                    async for text in stream.text_stream:
+                        parts.append(text)
+                        yield text
+            except Exception as e:
+                logger.exception("Claude API error")
+                # Once text has been sent the answer is truncated; let the caller report it
+                if parts:
+                    raise
+                yield self._fallback_response(location, db_context, e)
+                return
+            self._record_exchange(query, ''.join(parts))
+        
+        return chunks(), map_directive
+    
+    def _record_exchange(self, query: str, response: str):
+        """Store a completed exchange in conversation history"""
+        self.conversation_history.append({
+            "timestamp": datetime.now().isoformat(),
+            "query": query,
+            "response": response
+        })
+    
+    def _fallback_response(self, location: str, db_context: Dict, error: Exception) -> str:
+        """Fallback response with available data when Claude is unavailable"""
+        return f"""
             **⚠️ Analisis Terbatas - API Error**
             
             Data {location}:
@@ -359,26 +530,75 @@ class ClaudeService:
             - ATM: {db_context.get('total_atms', 0)} lokasi  
             - POI: {db_context.get('total_poi', 0)} titik aktivitas
             
-            Error: {str(e)}
+            Error: {str(error)}
             """
-            return error_response, map_directive
+    
+    async def submit_batch(self, queries: List[str]) -> Dict:
+        """Submit queries through the Message Batches API (asynchronous, half the cost)"""
+        requests = []
+        submitted = []
+        for index, query in enumerate(queries):
+            params, map_directive, _, _ = await asyncio.to_thread(self.build_message_request, query)
+            custom_id = f"query-{index}"
+            requests.append({"custom_id": custom_id, "params": params})
+            submitted.append({"custom_id": custom_id, "query": query, "map_directive": map_directive})
+        
+        batch = await self.client.messages.batches.create(requests=requests)
+        return {
+            "batch_id": batch.id,
+            "status": batch.processing_status,
+            "requests": submitted
+        }
+    
+    async def get_batch(self, batch_id: str) -> Dict:
+        """Get batch status, with per-query responses once processing has ended"""
+        batch = await self.client.messages.batches.retrieve(batch_id)
+        status = {
+            "batch_id": batch.id,
+            "status": batch.processing_status,
+            "request_counts": batch.request_counts.model_dump(),
+            "results": None
+        }
+        
+        if batch.processing_status == "ended":
+            results = []
+            async for entry in await self.client.messages.batches.results(batch_id):
+                succeeded = entry.result.type == "succeeded"
+                results.append({
+                    "custom_id": entry.custom_id,
+                    "status": entry.result.type,
+                    "response": entry.result.message.content[0].text if succeeded else None
+                })
+            status["results"] = results
+        
+        return status
     
     def get_conversation_history(self) -> List[Dict]:
         """Get conversation history"""
-        return self.conversation_history
+        return list(self.conversation_history)
+    
+    def reload(self):
+        """Forget cached database results (after the database has been reloaded)"""
+        with self._db_cache_lock:
+            self._db_cache.clear()
     
     def clear_conversation_history(self):
         """Clear conversation history and cache"""
-        self.conversation_history = []
-        self._db_cache = {}
+        self.conversation_history.clear()
+        self.reload()
 
 # Usage example
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     api_key = os.getenv('CLAUDE_API_KEY')
     if not api_key:
         print("Please set CLAUDE_API_KEY environment variable")
         exit(1)
     
+    # The context queries need the tables and indexes added by the migration
+    from setup_database import migrate
+    migrate(DB_PATH)
+    
     service = ClaudeService(api_key)
     
     # Test queries
@@ -389,11 +609,15 @@ if __name__ == "__main__":
         "Lokasi strategis untuk coffee shop di Bali?"
     ]
     
-    for query in test_queries:
-        print(f"\n{'='*50}")
-        print(f"Query: {query}")
-        print('='*50)
-        
-        response, directive = service.generate_response(query)
-        print(f"Response: {response}")
-        print(f"Map Directive: {directive.mode}")
\ No newline at end of file
+    async def run_tests():
+        for query in test_queries:
+            print(f"\n{'='*50}")
+            print(f"Query: {query}")
+            print('='*50)
+            
+            response, directive = await service.generate_response(query)
+            print(f"Response: {response}")
+            print(f"Map Directive: {directive.mode}")
+    
+    # One event loop for the whole run: the async client is bound to it
+    asyncio.run(run_tests())
\ No newline at end of file
@@ -0,0 +1,112 @@
+import os
+import sys
+import hashlib
+import duckdb
+from contextlib import closing
+
+# The one place the database location is read; the API, gunicorn and the chat service import it
+DB_PATH = os.getenv('DB_PATH', 'localpulse.db')
+
+# Category partitions of poi_density, rebuilt on every migration so they track the source table
+PARTITIONS = [
+    "CREATE OR REPLACE TABLE poi_financial AS SELECT * FROM poi_density WHERE category IN ('Bank', 'ATM')",
+    "CREATE OR REPLACE TABLE poi_density_only AS SELECT * FROM poi_density WHERE category NOT IN ('Bank', 'ATM')",
+]
+
+# Per-district aggregates for the chat context queries (one row per province/district),
+# rebuilt with the partitions so the analysis never re-aggregates poi_density
+AGGREGATES = [
+    """CREATE OR REPLACE TABLE district_agg AS
+    SELECT province, district,
+           COUNT(*) FILTER (WHERE category = 'Bank') AS banks,
+           COUNT(*) FILTER (WHERE category = 'ATM') AS atms,
+           COUNT(*) FILTER (WHERE category IN ('Bank', 'ATM')) AS total_financial,
+           AVG(intensity) FILTER (WHERE category NOT IN ('Bank', 'ATM')) AS avg_poi_density,
+           COUNT(*) FILTER (WHERE category NOT IN ('Bank', 'ATM')) AS poi_points,
+           COUNT(*) FILTER (WHERE category NOT IN ('Bank', 'ATM') AND intensity > 0.7) AS high_spots
+    FROM poi_density
+    GROUP BY province, district""",
+]
+
+# Access paths for the API and chat filters (province + category / district predicates)
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_poi_prov_cat ON poi_density(province, category)",
+    "CREATE INDEX IF NOT EXISTS idx_poi_prov_dist ON poi_density(province, district)",
+    "CREATE INDEX IF NOT EXISTS idx_poi_financial_prov_dist ON poi_financial(province, district)",
+    "CREATE INDEX IF NOT EXISTS idx_poi_density_only_prov_dist ON poi_density_only(province, district)",
+    "CREATE INDEX IF NOT EXISTS idx_district_agg_prov ON district_agg(province)",
+]
+
+# Tables the API queries that the migration derives from poi_density
+DERIVED_TABLES = ('poi_financial', 'poi_density_only', 'district_agg')
+
+# Identifies the statements above, so a changed definition forces a rebuild
+SCHEMA_VERSION = hashlib.sha256('\n'.join(PARTITIONS + AGGREGATES + INDEXES).encode()).hexdigest()
+
+# Cheap read-only summary of the source rows the derived tables were built from
+SOURCE_FINGERPRINT = "SELECT COUNT(*)::VARCHAR || ':' || COALESCE(SUM(hash(p)), 0)::VARCHAR FROM poi_density p"
+
+def _table_names(conn) -> set:
+    return {name for (name,) in conn.execute("SELECT table_name FROM information_schema.tables").fetchall()}
+
+def missing_tables(conn) -> list:
+    """Return the derived tables that do not exist in the database"""
+    existing = _table_names(conn)
+    return [name for name in DERIVED_TABLES if name not in existing]
+
+def require_migrated(db_path: str = DB_PATH):
+    """Fail with an actionable message when the derived tables have not been built"""
+    if not os.path.exists(db_path):
+        raise RuntimeError(f"Database not found: {db_path}")
+    with closing(duckdb.connect(db_path, read_only=True)) as conn:
+        missing = missing_tables(conn)
+    if missing:
+        raise RuntimeError(
+            f"Database {db_path} is missing {', '.join(missing)}; "
+            f"run `python setup_database.py {db_path}` before starting the API")
+
+def _is_current(conn) -> bool:
+    """Whether the derived tables were built by this schema from the current source rows"""
+    if missing_tables(conn) or 'migration_state' not in _table_names(conn):
+        return False
+    state = conn.execute("SELECT version, source_fingerprint FROM migration_state").fetchone()
+    return state == (SCHEMA_VERSION, conn.execute(SOURCE_FINGERPRINT).fetchone()[0])
+
+def migrate(db_path: str = DB_PATH) -> bool:
+    """Apply idempotent schema additions the API relies on.
+
+    The API opens the database read-only, so this runs once, before any
+    server process attaches to the file. When the derived tables are already
+    current it only reads the file; returns whether anything was rebuilt.
+    """
+    with closing(duckdb.connect(db_path, read_only=True)) as conn:
+        if _is_current(conn):
+            return False
+    
+    conn = duckdb.connect(db_path)
+    try:
+        conn.execute("BEGIN TRANSACTION")
+        for statement in PARTITIONS + AGGREGATES + INDEXES:
+            conn.execute(statement)
+        # Recorded so the next start can skip the rebuild (see _is_current)
+        conn.execute("CREATE OR REPLACE TABLE migration_state (version VARCHAR, source_fingerprint VARCHAR)")
+        conn.execute("INSERT INTO migration_state VALUES (?, ?)",
+                     [SCHEMA_VERSION, conn.execute(SOURCE_FINGERPRINT).fetchone()[0]])
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return True
+
+def main():
+    db_path = sys.argv[1] if len(sys.argv) > 1 else DB_PATH
+    if not os.path.exists(db_path):
+        print(f"❌ Database not found: {db_path}")
+        sys.exit(1)
+
+    if migrate(db_path):
+        print(f"✅ Database ready: {db_path}")
+    else:
+        print(f"✅ Database already up to date: {db_path}")
+
+if __name__ == "__main__":
+    main()
@@ -25,6 +25,13 @@ start_server() {
             processes_found=true
         fi
         
+        # Kill gunicorn processes serving api:app
+        if pgrep -f "gunicorn.*api:app" > /dev/null; then
+            echo "🔴 Killing existing gunicorn api:app processes..."
+            pkill -f "gunicorn.*api:app"
+            processes_found=true
+        fi
+        
         # Kill Python processes running simple_api.py
         if pgrep -f "python.*simple_api.py" > /dev/null; then
             echo "🔴 Killing existing simple_api.py processes..."
@@ -59,6 +66,7 @@ start_server() {
             
             # Force kill any remaining processes
             pkill -9 -f "python.*api.py" 2>/dev/null || true
+            pkill -9 -f "gunicorn.*api:app" 2>/dev/null || true
             pkill -9 -f "python.*simple_api.py" 2>/dev/null || true
             
             echo "✅ Cleanup completed"
@@ -140,7 +148,7 @@ start_server() {
     echo "📋 Logs will be written to: $LOGFILE"
     
     cd "$SCRIPT_DIR"
-    nohup python api.py > "$LOGFILE" 2>&1 &
+    nohup gunicorn -c gunicorn.conf.py api:app > "$LOGFILE" 2>&1 &
     SERVER_PID=$!
     
     # Save PID to file
@@ -181,6 +189,7 @@ stop_server() {
         fi
     else
         echo "⚠️ No PID file found. Attempting to kill related processes..."
+        pkill -f "gunicorn.*api:app" && echo "✅ Killed gunicorn api:app processes" || echo "ℹ️ No gunicorn api:app processes found"
         pkill -f "python.*api.py" && echo "✅ Killed api.py processes" || echo "ℹ️ No api.py processes found"
     fi
 }